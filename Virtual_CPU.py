@@ -1,13 +1,19 @@
+import sys
+from array import array
 from typing import Callable, Optional, Union
-from inspect import getfullargspec
+from functools import partial
 
 MAX_MEM: int = 1000
 MIN_MEM: int = 100
 MAX_REGISTERS: int = 20
 ABSTRACT_CLASS_ERROR: str = "This is an abstract class that is not meant to be instantiated."
+OUTPUT_BUFFER_LINES: int = 1024  # lines of program output held before writing them to stdout
+BRANCH_INSTRUCTIONS: tuple[str, ...] = ('jmp', 'je', 'jne', 'jg', 'jl', 'jle', 'jge', 'call')
 
 
 class Operand:
+    __slots__ = ()
+
     def get_value(self) -> None:
         raise NotImplementedError(ABSTRACT_CLASS_ERROR)
 
@@ -16,6 +22,8 @@ class Operand:
 
 
 class ReadOnlyOperand(Operand):
+    __slots__ = ('value',)
+
     def __init__(self, value) -> None:
         self.value: any = value
 
@@ -29,26 +37,53 @@ class ReadOnlyOperand(Operand):
 class Memory:
     def __init__(self, size: int) -> None:
         self.size: int = size
-        self.mem: list[Union[str, int, float]] = [0] * size  # allocate memory and initialize to 0
+        self.mem: list[Union[str, int, float, Callable]] = [0] * size  # allocate memory and initialize to 0
+
+    # Locations past the end surface as an IndexError from the list and are converted here, so only negative
+    # locations, which the list would wrap around, are checked up front.
 
     def set_mem(self, location: int, value: any) -> None:
         if location < 0:
-            raise RuntimeError('location (' + str(location) + ') is less than 0')
-        elif location > (self.size - 1):
-            raise RuntimeError('location (' + str(location) + ') is greater than memory size (' + str(self.size) + ')')
-        else:
+            raise RuntimeError(self.out_of_range(location))
+        try:
             self.mem[location] = value
+        except IndexError:
+            raise RuntimeError(self.out_of_range(location)) from None
 
-    def get_mem(self, location: int) -> Union[str, int, float]:
+    def get_mem(self, location: int) -> Union[str, int, float, Callable]:
         if location < 0:
-            raise RuntimeError('location (' + str(location) + ') is less than 0')
-        elif location > (self.size - 1):
-            raise RuntimeError('location (' + str(location) + ') is greater than memory size (' + str(self.size) + ')')
-        else:
+            raise RuntimeError(self.out_of_range(location))
+        try:
             return self.mem[location]
+        except IndexError:
+            raise RuntimeError(self.out_of_range(location)) from None
+
+    def out_of_range(self, location: int) -> str:
+        if location < 0:
+            return 'location (' + str(location) + ') is less than 0'
+        return 'location (' + str(location) + ') is greater than memory size (' + str(self.size) + ')'
+
+
+class IntMemory(Memory):
+    # Memory for integer-only data, backed by a typed array: 8 bytes per cell instead of a reference to an int object
+    def __init__(self, size: int) -> None:
+        self.size: int = size
+        self.mem: array = array('q', [0]) * size
+
+    def set_mem(self, location: int, value: any) -> None:
+        if location < 0:
+            raise RuntimeError(self.out_of_range(location))
+        try:
+            self.mem[location] = value
+        except IndexError:
+            raise RuntimeError(self.out_of_range(location)) from None
+        except (TypeError, OverflowError):
+            raise RuntimeError(f'Integer memory can only hold 64-bit integers, so "{value}" can\'t be stored') from None
 
 
 class MemoryOperand(Operand):
+    __slots__ = ('location', 'memory_object')
+
     def __init__(self, memory_object, location) -> None:
         self.location = location
         self.memory_object = memory_object
@@ -61,6 +96,8 @@ class MemoryOperand(Operand):
 
 
 class Literal(ReadOnlyOperand):
+    __slots__ = ()
+
     def __init__(self, value) -> None:
         super().__init__(value)
 
@@ -73,6 +110,8 @@ class Literal(ReadOnlyOperand):
 
 
 class Register(Operand):
+    __slots__ = ('value',)
+
     def __init__(self, value: int = 0) -> None:
         self.value: int = value
 
@@ -84,6 +123,8 @@ class Register(Operand):
 
 
 class StackPointer(Operand):
+    __slots__ = ('value', 'maxVal')
+
     def __init__(self, value) -> None:
         self.value = value
         self.maxVal = value
@@ -98,6 +139,12 @@ class StackPointer(Operand):
         if self.value < 0:
             raise RuntimeError("Stack overflow: stack pointer is " + str(self.value))
 
+    # Unchecked version of push, used when the CPU isn't in debug mode: pushing past the bottom of the stack still fails
+    # on the first write, since memory rejects location -1
+
+    def push_fast(self) -> None:
+        self.value -= 1
+
     def get_value(self) -> any:
         return self.value
 
@@ -105,23 +152,15 @@ class StackPointer(Operand):
         self.value = value
 
 
-class Flag:
-    def __init__(self, value=False) -> None:
-        self.value = value
-
-    def set_true(self) -> None:
-        self.value = True
-
-    def set_false(self) -> None:
-        self.value = False
-
-    def get_value(self) -> any:
-        return self.value
-
-
 class Instructions:
     def __init__(self, cpu) -> None:
         self.cpu = cpu
+        # number of operands each instruction takes, read once from the code objects instead of inspecting signatures
+        self._arity: dict[str, int] = {name: fn.__code__.co_argcount - 1 for name, fn in Instructions.__dict__.items()
+                                       if callable(fn) and not name.startswith('_')}
+        # program output waiting to be written by CPU.flush_output
+        self._out_buf: list[str] = []
+        self._out_write: Callable[[str], None] = self._out_buf.append
 
     def inc(self, op1) -> None:
         op1.set_value(op1.get_value() + 1)
@@ -131,14 +170,7 @@ class Instructions:
 
     def cmp(self, op1, op2) -> None:
         val = op1.get_value() - op2.get_value()
-        if 0 == val:
-            self.cpu.EqualFlag.set_true()
-        else:
-            self.cpu.EqualFlag.set_false()
-        if 0 < val:
-            self.cpu.GreaterFlag.set_true()
-        else:
-            self.cpu.GreaterFlag.set_false()
+        self.cpu.flags = (0 == val) + 2 * (0 < val)
 
     def out(self, op1) -> None:
         print(op1.get_value())
@@ -153,27 +185,27 @@ class Instructions:
         self.cpu.IC.set_value(op1.get_value())
 
     def je(self, op1) -> None:
-        if self.cpu.EqualFlag.get_value():
+        if self.cpu.flags == 1:
             self.cpu.IC.set_value(op1.get_value())
 
     def jne(self, op1) -> None:
-        if not self.cpu.EqualFlag.get_value():
+        if self.cpu.flags != 1:
             self.cpu.IC.set_value(op1.get_value())
 
     def jg(self, op1) -> None:
-        if self.cpu.GreaterFlag.get_value() and (not self.cpu.EqualFlag.get_value()):
+        if self.cpu.flags == 2:
             self.cpu.IC.set_value(op1.get_value())
 
     def jl(self, op1) -> None:
-        if (not self.cpu.GreaterFlag.get_value()) and (not self.cpu.EqualFlag.get_value()):
+        if self.cpu.flags == 0:
             self.cpu.IC.set_value(op1.get_value())
 
     def jle(self, op1) -> None:
-        if (not self.cpu.GreaterFlag.get_value()) or (self.cpu.EqualFlag.get_value()):
+        if self.cpu.flags != 2:
             self.cpu.IC.set_value(op1.get_value())
 
     def jge(self, op1) -> None:
-        if (self.cpu.GreaterFlag.get_value()) or (self.cpu.EqualFlag.get_value()):
+        if self.cpu.flags:
             self.cpu.IC.set_value(op1.get_value())
 
     def mul(self, op1, op2) -> None:
@@ -191,10 +223,10 @@ class Instructions:
         self.cpu.SP.pop()
 
     def save(self, to_address: Operand, value_to_set: Operand) -> None:
-        self.cpu.set_mem(to_address.get_value(), value_to_set.get_value())
+        self.cpu.data_memory.set_mem(to_address.get_value(), value_to_set.get_value())
 
     def load(self, from_address: Operand, to_operator: Operand) -> None:
-        to_operator.set_value(self.cpu.get_mem(from_address.get_value()))
+        to_operator.set_value(self.cpu.data_memory.get_mem(from_address.get_value()))
 
     def call(self, function_address: Operand) -> None:
         self.push(Literal(self.cpu.IC.get_value() + 1))
@@ -212,58 +244,325 @@ class Instructions:
     def nop(self) -> None:
         pass
 
+    # Branches whose target is known at load time: the CPU binds the raw address instead of a Literal
+
+    def _jmp_i(self, target: int) -> None:
+        self.cpu.IC.value = target
+
+    def _je_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags == 1:
+            cpu.IC.value = target
+
+    def _jne_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags != 1:
+            cpu.IC.value = target
+
+    def _jg_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags == 2:
+            cpu.IC.value = target
+
+    def _jl_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags == 0:
+            cpu.IC.value = target
+
+    def _jle_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags != 2:
+            cpu.IC.value = target
+
+    def _jge_i(self, target: int) -> None:
+        cpu = self.cpu
+        if cpu.flags:
+            cpu.IC.value = target
+
+    def _call_i(self, target: int) -> None:
+        cpu = self.cpu
+        cpu.SP.push()
+        cpu.stack.set_mem(cpu.SP.value, cpu.IC.value + 1)
+        cpu.IC.value = target
+
+    # Instructions that skip the stack overflow check or buffer their output, used when the CPU isn't in debug mode
+
+    def _out_fast(self, op1) -> None:
+        self._out_write(str(op1.get_value()) + '\n')
+        if len(self._out_buf) >= OUTPUT_BUFFER_LINES:
+            self.cpu.flush_output()
+
+    def _push_fast(self, from_operand: Operand) -> None:
+        cpu = self.cpu
+        cpu.SP.push_fast()
+        cpu.stack.set_mem(cpu.SP.value, from_operand.get_value())
+
+    def _call_i_fast(self, target: int) -> None:
+        cpu = self.cpu
+        cpu.SP.push_fast()
+        cpu.stack.set_mem(cpu.SP.value, cpu.IC.value + 1)
+        cpu.IC.value = target
+
+    def _ret_fast(self) -> None:
+        cpu = self.cpu
+        cpu.IC.value = cpu.stack.get_mem(cpu.SP.value)
+        cpu.SP.pop()
+
+    # Register (_r) and immediate (_i) forms: the CPU picks these when the operand types are known at load time, so
+    # they read and write .value directly instead of going through the Operand methods
+
+    def _inc_r(self, r1: Register) -> None:
+        r1.value += 1
+
+    def _dec_r(self, r1: Register) -> None:
+        r1.value -= 1
+
+    def _cmp_rr(self, r1: Register, r2: Register) -> None:
+        val = r1.value - r2.value
+        self.cpu.flags = (0 == val) + 2 * (0 < val)
+
+    def _cmp_ri(self, r1: Register, imm) -> None:
+        val = r1.value - imm
+        self.cpu.flags = (0 == val) + 2 * (0 < val)
+
+    def _add_rr(self, r1: Register, r2: Register) -> None:
+        r1.value += r2.value
+
+    def _add_ri(self, r1: Register, imm) -> None:
+        r1.value += imm
+
+    def _sub_rr(self, r1: Register, r2: Register) -> None:
+        r1.value -= r2.value
+
+    def _sub_ri(self, r1: Register, imm) -> None:
+        r1.value -= imm
+
+    def _mul_rr(self, r1: Register, r2: Register) -> None:
+        r1.value *= r2.value
+
+    def _mul_ri(self, r1: Register, imm) -> None:
+        r1.value *= imm
+
+    def _div_rr(self, r1: Register, r2: Register) -> None:
+        r1.value //= r2.value
+
+    def _div_ri(self, r1: Register, imm) -> None:
+        r1.value //= imm
+
+    def _set_rr(self, r1: Register, r2: Register) -> None:
+        r1.value = r2.value
+
+    def _set_ri(self, r1: Register, imm) -> None:
+        r1.value = imm
+
+    # Superinstructions: the CPU fuses a cmp with the conditional jump that follows it
+
+    def _cmp_jump(self, op1, op2, taken: tuple[bool, bool, bool], target: int, fallthrough: int) -> None:
+        # taken says whether to branch for each value of CPU.flags
+        cpu = self.cpu
+        val = op1.get_value() - op2.get_value()
+        flags: int = (0 == val) + 2 * (0 < val)
+        cpu.flags = flags
+        cpu.IC.value = target if taken[flags] else fallthrough
+
+    def _cmp_jump_rr(self, r1: Register, r2: Register, taken: tuple[bool, bool, bool], target: int,
+                     fallthrough: int) -> None:
+        cpu = self.cpu
+        val = r1.value - r2.value
+        flags: int = (0 == val) + 2 * (0 < val)
+        cpu.flags = flags
+        cpu.IC.value = target if taken[flags] else fallthrough
+
+    def _cmp_jump_ri(self, r1: Register, imm, taken: tuple[bool, bool, bool], target: int, fallthrough: int) -> None:
+        cpu = self.cpu
+        val = r1.value - imm
+        flags: int = (0 == val) + 2 * (0 < val)
+        cpu.flags = flags
+        cpu.IC.value = target if taken[flags] else fallthrough
+
 
 class CPU:
-    def __init__(self, registers: int, memory: Memory, stack_memory: Memory, debug_print: bool = False) -> None:
-        self.memory: Memory = memory
+    # opcode numbers index the handler and arity tables built in __init__
+    _OPS: dict[str, int] = {name: opcode for opcode, name in enumerate((
+        'inc', 'dec', 'cmp', 'out', 'add', 'sub', 'jmp', 'je', 'jne', 'jg', 'jl', 'jle', 'jge', 'mul', 'div', 'push',
+        'pop', 'save', 'load', 'call', 'ret', 'set', 'end', 'nop'))}
+
+    def __init__(self, registers: int, code_memory: Memory, data_memory: Memory, stack_memory: Memory,
+                 debug_print: bool = False) -> None:
+        # instructions are only fetched from code memory; data operands and load/save only touch data memory
+        self.code_memory: Memory = code_memory
+        self.data_memory: Memory = data_memory
         self.stack: Memory = stack_memory
         self.registers: list[Register] = [Register() for _ in range(registers)]
         self.IC: Register = Register(0)
         self.instructions: Instructions = Instructions(self)
-        self.EqualFlag: Flag = Flag()
-        self.GreaterFlag: Flag = Flag()
+        self._handlers: tuple[Callable, ...] = tuple(getattr(self.instructions, name) for name in self._OPS)
+        self._arity: tuple[int, ...] = tuple(self.instructions._arity[name] for name in self._OPS)
+        self._branch_handlers: dict[int, Callable] = {self._OPS[name]: getattr(self.instructions, f'_{name}_i')
+                                                      for name in BRANCH_INSTRUCTIONS}
+        # outside of debug mode, pushes are threaded without the stack overflow check and out is buffered
+        self._fast_handlers: tuple[Callable, ...] = tuple(
+            getattr(self.instructions, f'_{name}_fast', handler) for name, handler in zip(self._OPS, self._handlers))
+        self._fast_branch_handlers: dict[int, Callable] = {**self._branch_handlers,
+                                                           self._OPS['call']: self.instructions._call_i_fast}
+        # specialized handlers keyed by (opcode, type of op1, type of op2)
+        self._typed_handlers: dict[tuple[int, type, type], Callable] = {}
+        for name in ('inc', 'dec'):
+            self._typed_handlers[self._OPS[name], Register, type(None)] = getattr(self.instructions, f'_{name}_r')
+        for name in ('cmp', 'add', 'sub', 'mul', 'div', 'set'):
+            self._typed_handlers[self._OPS[name], Register, Register] = getattr(self.instructions, f'_{name}_rr')
+            self._typed_handlers[self._OPS[name], Register, Literal] = getattr(self.instructions, f'_{name}_ri')
+        # whether each conditional jump is taken, indexed by the value of flags
+        self._branch_conditions: dict[int, tuple[bool, bool, bool]] = {
+            self._OPS['je']: (False, True, False),
+            self._OPS['jne']: (True, False, True),
+            self._OPS['jg']: (False, False, True),
+            self._OPS['jl']: (True, False, False),
+            self._OPS['jle']: (True, True, False),
+            self._OPS['jge']: (False, True, True),
+        }
+        self.flags: int = 0  # result of the last cmp: 1 if equal, 2 if greater, 0 otherwise
         self.SP: StackPointer = StackPointer(stack_memory.size - 1)
         self.labels: dict[str, int] = {}
+        self.listing: dict[int, str] = {}  # source text of each loaded instruction, for debug printing
+        # decoded operands are shared between instructions; literals are keyed by type too, so #1 and #1.0 differ
+        self._lit_cache: dict[tuple[type, any], Literal] = {}
+        self._mem_cache: dict[int, MemoryOperand] = {}
+        # decoded operand strings; only valid while the labels stay the same
+        self._operand_cache: dict[str, Operand] = {}
         self.debug_print: bool = debug_print
+        # the debug_print setting the loaded code was threaded with; the handlers, fusion and peephole pass depend on it
+        self._threaded_debug: bool = debug_print
 
     def execute_program(self, entry_point=0) -> None:
         print('Starting Program at Entry Point ' + str(entry_point))
         self.IC.set_value(entry_point)
-        ic_val: int = self.IC.get_value()
-        while self.execute_instruction():
-            if self.IC.get_value() == ic_val:
-                self.IC.set_value(self.IC.get_value() + 1)
-            ic_val: int = self.IC.get_value()
+        try:
+            if self._threaded_debug:
+                ic_val: int = self.IC.get_value()
+                while self.execute_instruction():
+                    if self.IC.get_value() == ic_val:
+                        self.IC.set_value(self.IC.get_value() + 1)
+                    ic_val: int = self.IC.get_value()
+            else:
+                self.run_instructions(entry_point)
+        finally:
+            self.flush_output()
         print('Program Ended')
 
+    def flush_output(self) -> None:
+        out_buf: list[str] = self.instructions._out_buf
+        if out_buf:
+            sys.stdout.write(''.join(out_buf))
+            out_buf.clear()
+
+    def run_instructions(self, ic: int) -> None:
+        # The same loop as in debug mode, with the instruction counter and code memory bound to locals. Every cell
+        # Computer.load_program fills is callable, including lines that failed to decode and empty cells.
+        ic_register: Register = self.IC
+        code: list[Callable[[], Optional[bool]]] = self.code_memory.mem
+        if ic < 0:  # the list would wrap around
+            raise RuntimeError(self.code_memory.out_of_range(ic))
+        try:
+            while True:
+                if code[ic]() is False:
+                    break
+                if ic_register.value == ic:
+                    ic += 1
+                    ic_register.value = ic
+                else:  # only a jump can make the instruction counter negative
+                    ic = ic_register.value
+                    if ic < 0:
+                        raise RuntimeError(self.code_memory.out_of_range(ic))
+        except IndexError:
+            raise RuntimeError(self.code_memory.out_of_range(ic)) from None
+
     def execute_instruction(self) -> bool:
-        instruction_string: str = self.memory.get_mem(self.IC.get_value())
+        # every cell is callable: Computer.load_program fills code memory with threaded instructions and "end"
+        instruction: Callable[[], Optional[bool]] = self.code_memory.get_mem(self.IC.get_value())
+        source: str = self.listing.get(self.IC.get_value(), getattr(instruction, '__name__', str(instruction)))
         if self.debug_print:
-            print(instruction_string)
-        if instruction_string is not None:
-            return self.decode_instruction(instruction_string)
-        else:
-            return False
+            print(source)
+        return self.check_result(instruction(), source.split(' ', 1)[0])
 
-    def decode_instruction(self, instruction_string: str) -> bool:
+    def undecoded_instruction(self, tokens: tuple[str, tuple[str, ...]]) -> Optional[bool]:
+        # stands in for a line that didn't decode at load time: decoding it again reports why once it's reached
+        return self.compile_instruction(tokens)()
+
+    def compile_instruction(self, instruction: Union[str, tuple[str, tuple[str, ...]]]) -> Callable[[], Optional[bool]]:
+        if isinstance(instruction, str):
+            instruction = self.tokenize_instruction(instruction)
+        return self.thread_instruction(*self.parse_instruction(instruction))
+
+    def tokenize_instruction(self, instruction_string: str) -> tuple[str, tuple[str, ...]]:
+        # split a line into its instruction name and operand strings; only two-operand instructions split on ", " so
+        # a single string operand may contain commas
         split_instruction: list[str] = instruction_string.split(' ', 1)
         instruction_name: str = split_instruction[0]
+        if len(split_instruction) == 1:
+            return instruction_name, ()
+        opcode: Optional[int] = self._OPS.get(instruction_name)
+        if opcode is not None and self._arity[opcode] == 2:
+            return instruction_name, tuple(split_instruction[1].split(', ', 1))
+        return instruction_name, (split_instruction[1],)
+
+    def parse_instruction(self,
+                          tokens: tuple[str, tuple[str, ...]]) -> tuple[int, Optional[Operand], Optional[Operand]]:
+        instruction_name, operands = tokens
         try:
-            instruction_function: Callable = getattr(self.instructions, instruction_name)
-        except AttributeError:
+            opcode: int = self._OPS[instruction_name]
+        except KeyError:
             raise RuntimeError(f'You\'ve attempted to call a nonexistent instruction: "{instruction_name}"...weird...')
-        else:
-            num_operands: int = len(getfullargspec(instruction_function).args) - 1
+        num_operands: int = self._arity[opcode]
+        if len(operands) < num_operands:
+            raise RuntimeError(f'"{instruction_name}" needs {num_operands} operand(s) but was given {len(operands)}.')
+        op1: Optional[Operand] = self.decode_operand(operands[0]) if num_operands > 0 else None
+        op2: Optional[Operand] = self.decode_operand(operands[1]) if num_operands > 1 else None
+        return opcode, op1, op2
+
+    def thread_instruction(self, opcode: int, op1: Optional[Operand],
+                           op2: Optional[Operand]) -> Callable[[], Optional[bool]]:
+        # bind the decoded operands to the handler so executing it is a single call with no arguments
+        branch_handlers: dict[int, Callable] = \
+            self._branch_handlers if self._threaded_debug else self._fast_branch_handlers
+        if opcode in branch_handlers and isinstance(op1, Literal) and isinstance(op1.value, int):
+            return partial(branch_handlers[opcode], op1.value)
+        typed_handler: Optional[Callable] = self._typed_handlers.get((opcode, type(op1), type(op2)))
+        if typed_handler is not None:
+            if isinstance(op2, Literal):
+                return partial(typed_handler, op1, op2.value)
+            elif op2 is not None:
+                return partial(typed_handler, op1, op2)
+            else:
+                return partial(typed_handler, op1)
+        instruction_function: Callable = (self._handlers if self._threaded_debug else self._fast_handlers)[opcode]
+        num_operands: int = self._arity[opcode]
         if num_operands == 2:
-            operands: list[str] = split_instruction[1].split(', ', 1)
-            op1: Operand = self.decode_operand(operands[0])
-            op2: Operand = self.decode_operand(operands[1])
-            result: Optional[bool] = instruction_function(op1, op2)
+            return partial(instruction_function, op1, op2)
         elif num_operands == 1:
-            op1: Operand = self.decode_operand(split_instruction[1])
-            result: Optional[bool] = instruction_function(op1)
+            return partial(instruction_function, op1)
         else:
-            result: Optional[bool] = instruction_function()
+            return instruction_function
+
+    def fuse_instructions(self, address: int, first: tuple[int, Optional[Operand], Optional[Operand]],
+                          second: Optional[tuple[int, Optional[Operand], Optional[Operand]]]) -> Optional[Callable]:
+        # "cmp a, b" followed by a conditional jump to a known address becomes one call that compares and branches.
+        # The jump keeps its own slot, so jumping straight to it still works; the fused instruction just skips it.
+        if second is None or first[0] != self._OPS['cmp'] or second[0] not in self._branch_conditions:
+            return None
+        target: Optional[Operand] = second[1]
+        if not (isinstance(target, Literal) and isinstance(target.value, int)):
+            return None
+        taken: tuple[bool, bool, bool] = self._branch_conditions[second[0]]
+        op1, op2 = first[1], first[2]
+        if type(op1) is Register and type(op2) is Register:
+            return partial(self.instructions._cmp_jump_rr, op1, op2, taken, target.value, address + 2)
+        if type(op1) is Register and type(op2) is Literal:
+            return partial(self.instructions._cmp_jump_ri, op1, op2.value, taken, target.value, address + 2)
+        return partial(self.instructions._cmp_jump, op1, op2, taken, target.value, address + 2)
+
+    @staticmethod
+    def check_result(result: Optional[bool], instruction_name: str) -> bool:
         if result is None:  # result is None; this is normal (all instructions besides "end" return nothing)
             return True
         elif not result:  # result is False; the program has halted
@@ -273,6 +572,11 @@ class CPU:
             return True
 
     def decode_operand(self, op: str) -> Operand:
+        if op not in self._operand_cache:
+            self._operand_cache[op] = self.parse_operand(op)
+        return self._operand_cache[op]
+
+    def parse_operand(self, op: str) -> Operand:
         # Registers start with R
         # Literal Numbers start with #
         # Literal Strings start with "
@@ -281,7 +585,7 @@ class CPU:
         # Instruction Counter = IC
         if op in self.labels:
             label_location: int = self.labels[op]
-            return Literal(label_location)
+            return self.intern_literal(label_location)
         if op == 'SP':
             return self.SP
         if op == 'IC':
@@ -306,35 +610,157 @@ class CPU:
                     literal_value = float(op_value)
                 except ValueError:
                     raise RuntimeError(f'I expected "{op_value}" to be an int or float! what am I supposed to do here?')
-            return Literal(literal_value)
+            return self.intern_literal(literal_value)
         if op_type == '"':
-            return Literal(op_value[:-1])
+            return self.intern_literal(op_value[:-1])
         if op_type == 'M':
-            return MemoryOperand(self.memory, int(op_value))
+            location: int
+            try:
+                location = int(op_value)
+            except ValueError:
+                raise RuntimeError(f'Uh what? You want me to convert "{op_value}" to an int? That\'s not possible...')
+            if location not in self._mem_cache:
+                self._mem_cache[location] = MemoryOperand(self.data_memory, location)
+            return self._mem_cache[location]
         raise RuntimeError(f'Can\'t decode operand "{op}". There is no label with that name. I have no clue what '
                            f'you\'re trying to say.')
 
+    def clear_decode_cache(self) -> None:
+        self._operand_cache.clear()
+
+    def intern_literal(self, value: any) -> Literal:
+        key: tuple[type, any] = (type(value), value)
+        if key not in self._lit_cache:
+            self._lit_cache[key] = Literal(value)
+        return self._lit_cache[key]
+
+
+def peephole(lines: list[tuple[tuple[str, ...], str, tuple[str, tuple[str, ...]]]]) \
+        -> list[tuple[tuple[str, ...], str, tuple[str, tuple[str, ...]]]]:
+    # Shrinks a tokenized program (labels, text and tokens of each line) before it's given addresses: nops are dropped
+    # and a register set to an integer literal absorbs the integer arithmetic on it that follows. A line with a label is
+    # never folded into the line before it, since something jumps there. This renumbers the program, so it's skipped if
+    # anything could see an address: IC used as an operand, a branch to anything but a label, a label used as a value,
+    # or push, pop or SP in a program that also has call or ret, since return addresses share the stack.
+    labels: set[str] = {label for line_labels, _, _ in lines for label in line_labels}
+    names: set[str] = set()
+    for _, _, (name, operands) in lines:
+        names.add(name)
+        for operand in operands:
+            if operand == 'IC' or (operand in labels) != (name in BRANCH_INSTRUCTIONS):
+                return lines
+            if operand == 'SP':
+                names.add('SP')
+    if names & {'push', 'pop', 'SP'} and names & {'call', 'ret'}:
+        return lines
+    result: list[tuple[tuple[str, ...], str, tuple[str, tuple[str, ...]]]] = []
+    pending_labels: tuple[str, ...] = ()  # labels of dropped nops, which move to the next line
+    for line_labels, text, tokens in lines:
+        line_labels = pending_labels + line_labels
+        if tokens[0] == 'nop':
+            pending_labels = line_labels
+            continue
+        pending_labels = ()
+        folded: Optional[tuple[str, tuple[str, ...]]] = None
+        if result and not line_labels:
+            folded = _fold_arithmetic(result[-1][2], tokens, labels)
+        if folded is not None:
+            result[-1] = (result[-1][0], f'{folded[0]} {", ".join(folded[1])}', folded)
+        else:
+            result.append((line_labels, text, tokens))
+    if pending_labels:  # the program ended with labelled nops; keep one so the labels still point somewhere
+        result.append((pending_labels, 'nop', ('nop', ())))
+    return result
+
+
+def _arithmetic_step(tokens: tuple[str, tuple[str, ...]], labels: set[str]) -> Optional[tuple[str, str, int]]:
+    # describe inc/dec/add/sub/set/mul/div of a register by an integer literal as (operation, register, amount), with
+    # inc, dec and sub expressed as add
+    name, operands = tokens
+    if not operands or operands[0][:1] != 'R' or operands[0] in labels:
+        return None
+    if name in ('inc', 'dec'):
+        return 'add', operands[0], 1 if name == 'inc' else -1
+    if name not in ('add', 'sub', 'set', 'mul', 'div') or len(operands) != 2 or operands[1][:1] != '#':
+        return None
+    try:
+        amount: int = int(operands[1][1:])
+    except ValueError:
+        return None
+    if name == 'sub':
+        return 'add', operands[0], -amount
+    return name, operands[0], amount
+
+
+def _fold_arithmetic(first: tuple[str, tuple[str, ...]], second: tuple[str, tuple[str, ...]],
+                     labels: set[str]) -> Optional[tuple[str, tuple[str, ...]]]:
+    # the tokens of one instruction doing the same as first followed by second, if there is one. Only "set R, #int"
+    # absorbs what follows: anywhere else the register could hold a float, and regrouping float additions changes them
+    first_step: Optional[tuple[str, str, int]] = _arithmetic_step(first, labels)
+    second_step: Optional[tuple[str, str, int]] = _arithmetic_step(second, labels)
+    if first_step is None or second_step is None or first_step[0] != 'set' or first_step[1] != second_step[1]:
+        return None
+    _, register, amount = first_step
+    if second_step[0] == 'add':
+        amount += second_step[2]
+    elif second_step[0] == 'mul':
+        amount *= second_step[2]
+    elif second_step[0] == 'div' and second_step[2] != 0:
+        amount //= second_step[2]
+    else:
+        return None
+    return 'set', (register, f'#{amount}')
+
 
 class Computer:
-    def __init__(self, registers=10, memory=256):
-        self.memory: Memory = Memory(memory)
+    def __init__(self, registers=10, memory=256, int_memory=False):
+        self.codeMem: Memory = Memory(memory)
+        self.memory: Memory = IntMemory(memory) if int_memory else Memory(memory)
         self.stackMem: Memory = Memory(memory)
-        self.processor: CPU = CPU(registers, self.memory, self.stackMem)
+        self.processor: CPU = CPU(registers, self.codeMem, self.memory, self.stackMem)
+        for location in range(memory):
+            self.codeMem.set_mem(location, self.processor.instructions.end)  # empty cells halt the CPU if executed
 
     def load_program(self, program: str, entry_point: int = 0):
-        i: int = entry_point
+        self.processor.clear_decode_cache()  # anything decoded for an earlier program may refer to its labels
+        self.processor._threaded_debug = self.processor.debug_print  # changing debug_print later takes a reload
+        lines: list[tuple[tuple[str, ...], str, tuple[str, tuple[str, ...]]]] = []  # labels, text and tokens
         for string in program.splitlines():
             set_string: str = string
             if set_string[:1] != ';':  # line is commented out
+                labels: tuple[str, ...] = ()
                 split_instruction: list[str] = string.split(' ', 1)
                 label_name: str = split_instruction[0]
                 if label_name[-1:] == ':':  # line starts with a label
-                    self.processor.labels[label_name[:-1]] = i  # store the address of this label in a dict
+                    labels = (label_name[:-1],)
                     set_string = split_instruction[1]
-                self.memory.set_mem(i, set_string)
-                i += 1
+                lines.append((labels, set_string, self.processor.tokenize_instruction(set_string)))
+        if not self.processor._threaded_debug:  # debug mode runs the program exactly as it was written
+            lines = peephole(lines)
+        for address, (labels, _, _) in enumerate(lines, entry_point):
+            for label in labels:
+                self.processor.labels[label] = address  # store the address of this label in a dict
+        # second pass: now that every label is known, decode each line once so execution doesn't have to
+        parsed: dict[int, tuple[int, Optional[Operand], Optional[Operand]]] = {}
+        for address, (_, _, tokens) in enumerate(lines, entry_point):
+            try:
+                parsed[address] = self.processor.parse_instruction(tokens)
+            except RuntimeError:  # not a valid instruction (e.g. data); running it reports the error
+                pass
+        for address, (_, set_string, tokens) in enumerate(lines, entry_point):
+            instruction: Callable[[], Optional[bool]] = partial(self.processor.undecoded_instruction, tokens)
+            if address in parsed:
+                fused: Optional[Callable] = None
+                if not self.processor._threaded_debug:  # debug mode traces each instruction as it was written
+                    fused = self.processor.fuse_instructions(address, parsed[address], parsed.get(address + 1))
+                instruction = fused or self.processor.thread_instruction(*parsed[address])
+            self.codeMem.set_mem(address, instruction)
+            self.processor.listing[address] = set_string
 
     def start(self, entry_point=0):
+        # Outside debug mode the peephole pass may have dropped or merged lines, so a line's address can differ from its
+        # position in the source. Start at the address load_program was given, or at a label's address from
+        # self.processor.labels; other numbers only match the source line in debug mode or when the pass was skipped.
         self.processor.execute_program(entry_point)
 
     def run_program(self, program: str, entry_point: int = 0):